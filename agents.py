@@ -1,26 +1,40 @@
 # =============================================================================
 # agents.py — Orchestrates routing, subquestion/column selection, filter parsing,
-# SQL generation, and validation for a Text-to-SQL system built on LangChain
-# and LangGraph. A single shared LLM client is used across chains.
+# SQL generation, and validation for a Text-to-SQL system built on LangChain.
+# A single shared LLM client is used across chains.
+#
+# Importing this module is cheap: LangChain, the LLM client and the
+# knowledgebase are all loaded on first use, not at import time.
 # =============================================================================
 
 from __future__ import annotations
 import os
-import pickle
 import re
-from typing import TypedDict, Annotated, List
-from operator import add
+from functools import lru_cache
+from collections.abc import Mapping
+from typing import TypedDict, List
 
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnableMap
-from langgraph.graph import StateGraph, START, END
+import fastjsonschema
+import orjson
 
-from config import get_llm, get_knowledgebase_path
-from utils import parse_nested_list, normalize_subquestions
+from config import get_llm, get_knowledgebase_path, LLM_MAX_CONCURRENCY
+from llm_cache import CachedChain
+from utils import (
+    NESTED_LIST_RE, parse_nested_list, normalize_subquestions, normalize_text, strip_code_fences, to_json,
+)
+
+# Prompt layout: all static instructions/hints live in the system message and
+# the human message carries only per-call inputs, with the user question last.
+# This keeps the prompt prefix byte-identical across calls so Azure OpenAI's
+# automatic prefix caching can reuse it.
 
-# Single shared LLM client (cached by config.get_llm)
-llm = get_llm()
+
+def _build_chain(messages: list):
+    """prompt | shared LLM (cached by config.get_llm) | str parser.
+    Called by CachedChain on first use, so LangChain is imported lazily."""
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    return ChatPromptTemplate.from_messages(messages) | get_llm() | StrOutputParser()
 
 # ===========================
 # Router 
@@ -29,13 +43,12 @@ llm = get_llm()
 # relevant for a given natural language question. Output MUST be a Python-like
 # list literal of agent names (strings). Downstream code parses it with
 # ast.literal_eval.
-_router_template = ChatPromptTemplate.from_messages([
+_router_messages = [
     ("system", """
 You are an intelligent router in text to sql system that understands the user question and 
 determines which agents might have answer to the question based on agent description. Multiple agents might answer a given user question. OUTPUT SHOULD BE IN FORM OF LIST OF strings.
 Dont give any explanation or any other verbose in the output.
-"""),
-    ("human", '''
+
 Below are descriptions of different agents.
 customer agent : It contains all the details about customer and seller locations and their unique identifiers
 orders agent : It contains details about all the orders like product identifier, order identifier, products in an order, no. of items of a product in order, price of order, frieght value, order time, delivery status and its time, payment etc.
@@ -51,12 +64,16 @@ STEP BY STEP TABLE SELECTION PROCESS:
 ['customer']
 - For a give question, if customer and orders and product agent can answer question, give output like below without any verbose.
 ['customer', 'orders', 'product']
-     
+"""),
+    ("human", '''
 User question:
 {question}
 ''')
-])
-_router_chain = (RunnableMap({"question": lambda x: x["question"]}) | _router_template | llm | StrOutputParser())
+]
+_router_chain = CachedChain(
+    "router",
+    lambda: _build_chain(_router_messages),
+)
 
 
 def agent_router(question: str) -> str:
@@ -72,7 +89,7 @@ def agent_router(question: str) -> str:
 # =========================================
 # LLM creates minimal subquestions and assigns each to a single best table.
 # Note: downstream logic can link across tables later via known join keys.
-template_subquestion = ChatPromptTemplate.from_messages([
+messages_subquestion = [
     ("system", """
 You are an intelligent subquestion generator that creates subquestions based on human instructions and the provided CONTEXT. You operate as part of a Text-to-SQL agent.
 
@@ -92,8 +109,7 @@ DATASET-SPECIFIC MAPPING HINTS (very important):
 - Total sales / revenue → SUM(order_payments.payment_value), joined to orders via order_id.
 - Reviews → order_reviews.review_score linked by order_id.
 - English category → category_translation.product_category_name_english joined to products.product_category_name.
-"""),
-    ("human", '''
+
 CONTEXT:
 This dataset is from Olist, the largest department store on Brazilian marketplaces. 
 When a customer purchases a product from Olist (via a specific seller and location), the seller is notified to fulfill the order. 
@@ -120,29 +136,27 @@ Output format (STRICT):
 - DO NOT group multiple subquestions into a single element.
 - If multiple subquestions map to the same table, repeat that table in separate elements.
 - If no valid subquestions: []
-
+"""),
+    ("human", '''
 Table List:
 {tables}
 
 User question:
 {user_query}
 ''')
-])
-
-# Runnable that feeds the prompt, runs the LLM, and parses as a string
-chain_subquestion = (
-    RunnableMap({
-        "tables": lambda x: x["tables"],
-        "user_query": lambda x: x["user_query"]
-    })
-    | template_subquestion
-    | llm
-    | StrOutputParser()
+]
+
+# Runnable that feeds the prompt, runs the LLM, and parses as a string.
+# Every chain below is wrapped in CachedChain so repeated prompts skip the LLM.
+chain_subquestion = CachedChain(
+    "subquestion",
+    lambda: _build_chain(messages_subquestion),
+    normalize=("user_query",),
 )
 
 # Column selection for each subquestion. Picks only the columns needed for
 # correct SQL generation and linking; emphasizes identifiers and location fields.
-template_column = ChatPromptTemplate.from_messages([
+messages_column = [
     ("system", """
 You are an intelligent data column selector that chooses the most relevant columns from a list of available column descriptions to help answer a subquestion ONLY.
 Your selections will be used by a SQL generation agent, so choose **only those columns** that will help write the correct SQL query for a subquestion based on main question.
@@ -183,24 +197,42 @@ subquestion:
 Main question:
 {main_question}
 ''')
-])
-
-chain_column_extractor = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"],
-        "main_question": lambda x: x["main_question"]
-    })
-    | template_column
-    | llm
-    | StrOutputParser()
+]
+
+chain_column_extractor = CachedChain(
+    "column",
+    lambda: _build_chain(messages_column),
+    normalize=("query", "main_question"),
+)
+
+# JSON repair for subquestion/column replies that break the output contract.
+# Much smaller than re-running the original prompt.
+messages_json_repair = [
+    ("system", """
+You repair malformed model output into valid JSON.
+
+STRICT OUTPUT CONTRACT:
+- Return ONLY a JSON array of 2-item arrays of strings: [["<item1>", "<item2>"], ...]
+- Keep the original content and order; do not add, drop or rephrase entries.
+- If an entry has more than 2 items, keep the first and join the rest into the second with "; ".
+- Use double quotes for all strings. No code fences, no prose.
+- If nothing usable is present, return [].
+"""),
+    ("human", '''
+Malformed output:
+{raw}
+''')
+]
+chain_json_repair = CachedChain(
+    "json_repair",
+    lambda: _build_chain(messages_json_repair),
 )
 
 # ----------------------------
 # Filter / SQL / Validation
 # ----------------------------
 # Extract WHERE-like filters implied by the question, returned as strict JSON.
-template_filter_check = ChatPromptTemplate.from_messages([
+messages_filter_check = [
     ("system", """
 You help a text-to-SQL agent decide WHAT filters are implied by a user's question.
 Return a STRICT JSON array:
@@ -217,28 +249,130 @@ Rules:
 Return ONLY the JSON array, no prose.
 """),
     ("human", '''
-User question:
-{query}
-
 Available tables and columns (with sample values):
 {columns}
+
+User question:
+{query}
 ''')
-])
-
-chain_filter_extractor = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"]
-    })
-    | template_filter_check
-    | llm
-    | StrOutputParser()
+]
+
+chain_filter_extractor = CachedChain(
+    "filter",
+    lambda: _build_chain(messages_filter_check),
 )
 
+# ----------- Table-scoped schema hints -----------
+# Join keys and dataset hints are only sent for the tables in scope for a
+# question (see schema_hints_for), instead of the full list on every call.
+# They go into the human message so the static system prompt stays cacheable.
+
+# Join key column -> tables that share it
+JOIN_KEYS = [
+    ("order_id", ["orders", "order_items", "order_payments", "order_reviews"]),
+    ("customer_id", ["orders", "customer"]),
+    ("product_id", ["order_items", "products"]),
+    ("product_category_name", ["products", "category_translation"]),
+    ("seller_id", ["order_items", "sellers"]),
+]
+
+SCHEMA_HINTS_BY_TABLE = {
+    "customer": "Customer city/state come from customer.customer_city / customer.customer_state via orders.customer_id = customer.customer_id. Do NOT use non-existent columns like orders.city or orders.state; if a query references them, replace them and add that join.",
+    "order_items": "Seller-level order counts from item-level data: COUNT(DISTINCT order_items.order_id) grouped by order_items.seller_id; order by that count DESC and limit as needed.",
+    "orders": "For “average delivery time”, default to DAYS: TIMESTAMPDIFF(DAY, orders.order_purchase_timestamp, orders.order_delivered_customer_date), excluding NULL timestamps unless the user explicitly asks for hours.",
+}
+
+
+def _schema_hints(tables: tuple[str, ...]) -> str:
+    scope = set(tables)
+    keys = []
+    for col, group in JOIN_KEYS:
+        linked = [t for t in group if t in scope]
+        if len(linked) >= 2:
+            keys.append("- " + " ↔ ".join(f"{t}.{col}" for t in linked))
+    hints = [f"- {SCHEMA_HINTS_BY_TABLE[t]}" for t in sorted(scope) if t in SCHEMA_HINTS_BY_TABLE]
+    return (
+        "KNOWN JOIN KEYS (use only when present in the provided columns):\n"
+        + ("\n".join(keys) or "- (none between the tables in scope)")
+        + "\n\nSCHEMA HINTS:\n"
+        + ("\n".join(hints) or "- (none)")
+    )
+
+
+@lru_cache(maxsize=64)
+def _schema_hints_cached(tables: tuple[str, ...]) -> str:
+    return _schema_hints(tables)
+
+
+def schema_hints_for(tables: List[str]) -> str:
+    """Join-key and schema hint text covering only the given tables."""
+    return _schema_hints_cached(tuple(sorted(set(tables))))
+
+
+# ----------- Static SQL pre-check -----------
+# Cheap checks for the mistakes the LLM validator most often fixes. When the
+# generated SQL passes, the validator round-trip is skipped.
+
+_SELECT_START_RE = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_ORDERS_LOCATION_RE = re.compile(r"\borders\.(city|state)\b", re.IGNORECASE)
+# Unquoted reserved words used as aliases: "AS or", "FROM orders and", ...
+_RESERVED_ALIAS_RE = re.compile(
+    r"\bas\s+(or|and|as)\b|\b(from|join)\s+\w+\s+(or|and)\b", re.IGNORECASE
+)
+
+
+def _parens_balanced(sql: str) -> bool:
+    depth = 0
+    quote = None
+    for ch in sql:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"', "`"):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0 and quote is None
+
+
+@lru_cache(maxsize=None)
+def _table_ref_re(table: str) -> re.Pattern:
+    """FROM/JOIN reference to a table, compiled once per table name."""
+    return re.compile(rf"\b(from|join)\s+`?{re.escape(table)}`?(\s|$|,|\))", re.IGNORECASE)
+
+
+def _has_required_join_keys(sql: str, tables: List[str]) -> bool:
+    """Every JOIN_KEYS group linking two or more of the tables the SQL uses
+    must have its key column mentioned in the SQL."""
+    used = {t for t in tables if _table_ref_re(t).search(sql)}
+    if len(used) < 2:
+        return True
+    sql_lower = sql.lower()
+    for col, group in JOIN_KEYS:
+        if sum(t in used for t in group) >= 2 and col not in sql_lower:
+            return False
+    return True
+
+
+def static_sql_ok(sql: str, tables: List[str]) -> bool:
+    """True when the SQL passes the static pre-check (see above)."""
+    return (
+        bool(_SELECT_START_RE.match(sql))
+        and _parens_balanced(sql)
+        and not _ORDERS_LOCATION_RE.search(sql)
+        and not _RESERVED_ALIAS_RE.search(sql)
+        and _has_required_join_keys(sql, tables)
+    )
+
+
 # ----------- SQL GENERATOR -----------
 # Generates a single MySQL query string using the selected columns and filters.
-# Prompt encodes schema hints and known join keys to steer the model.
-template_sql_query = ChatPromptTemplate.from_messages([
+# Table-scoped join keys/hints (schema_hints_for) steer the model.
+messages_sql_query = [
     ("system", """
 You are an intelligent MySQL query generator.
 
@@ -252,16 +386,8 @@ SCHEMA COMPLIANCE
 - Prefer the tables and columns listed under "Relevant tables and columns" below.
 - If a standard join key or column is obviously required to connect the listed tables (see Known Join Keys) but is missing from the list, you may include it to produce a correct query.
 - Do not introduce unrelated tables or columns not needed to answer the question.
-
-KNOWN JOIN KEYS (helpful guidance, use only when present in the provided columns):
-- orders.order_id ↔ order_items.order_id ↔ order_payments.order_id ↔ order_reviews.order_id
-- orders.customer_id ↔ customer.customer_id
-- order_items.product_id ↔ products.product_id
-- products.product_category_name ↔ category_translation.product_category_name
-- order_items.seller_id ↔ sellers.seller_id
-
-SCHEMA MAPPING HINTS
-- Customer city/state come from customer.customer_city / customer.customer_state via orders.customer_id = customer.customer_id. Do NOT use non-existent columns like orders.city or orders.state.
+- Follow the "Known join keys and schema hints" given with the question.
+- orders has no city/state columns. Customer location comes from customer.customer_city / customer.customer_state via orders.customer_id = customer.customer_id; never use orders.city or orders.state.
 
 COLUMN USAGE POLICY
 - All columns listed under "Relevant tables and columns" are mandatory for traceability. Use them in SELECT and/or in JOIN/WHERE/GROUP BY/HAVING as their descriptions imply.
@@ -272,45 +398,38 @@ FILTERS
 
 AGGREGATION & DISTINCT
 - When counting logical entities that can repeat across rows (e.g., multiple items per order), use COUNT(DISTINCT <entity_id>) as appropriate to match the user’s intent.
-- For seller-level order counts from item-level data, compute COUNT(DISTINCT order_items.order_id) grouped by order_items.seller_id; order by that count DESC and limit as needed.
 
 STYLE & SAFETY
 - Use meaningful, short aliases (never SQL reserved words like 'or', 'and', 'as').
 - Prefer CTEs for readability if the query is long/complex, but ensure the CTE is fully defined and referenced.
-- For “average delivery time”, default to DAYS:
-  use TIMESTAMPDIFF(DAY, orders.order_purchase_timestamp, orders.order_delivered_customer_date)
-  and exclude NULL timestamps unless the user explicitly asks for hours.
 - Ensure the final query is syntactically valid MySQL and optimized for correctness.
 
 Return ONLY the final SQL statement.
 """),
     ("human", '''
-User question:
-{query}
+Known join keys and schema hints:
+{schema_hints}
 
 Relevant tables and columns:
 {columns}
 
 Applicable filters:
 {filters}
+
+User question:
+{query}
 ''')
-])
-
-chain_query_extractor = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"],
-        "filters": lambda x: x["filters"]
-    })
-    | template_sql_query
-    | llm
-    | StrOutputParser()
+]
+
+chain_query_extractor = CachedChain(
+    "sql_query",
+    lambda: _build_chain(messages_sql_query),
 )
 
 # ----------- VALIDATOR (soft-matching known join keys) -----------
 # Validates and, if needed, fixes the generated SQL while respecting the same
 # context and join-key guidance.
-template_validation = ChatPromptTemplate.from_messages([
+messages_validation = [
     ("system", """
 You are a highly capable and precise MySQL query validator and fixer.
 
@@ -324,15 +443,8 @@ SCHEMA & INPUT COMPLIANCE
 - Prefer the tables and columns listed in "Relevant Tables and Columns".
 - If the query uses a **standard join key or column** that is **obviously required** to connect the provided tables (see Known Join Keys) but was not listed, KEEP it (do not remove), as long as it only serves to correctly join the listed tables.
 - Do NOT introduce unrelated tables/columns outside the provided context.
-
-KNOWN JOIN KEYS (for reference during validation):
-- orders.order_id ↔ order_items.order_id ↔ order_payments.order_id ↔ order_reviews.order_id
-- orders.customer_id ↔ customer.customer_id
-- order_items.product_id ↔ products.product_id
-- products.product_category_name ↔ category_translation.product_category_name
-- order_items.seller_id ↔ sellers.seller_id
-
-- If a location field is referenced on the wrong table (e.g., orders.city), replace it with customer.customer_city / customer.customer_state AND add the necessary join orders.customer_id = customer.customer_id, provided these columns are available in the inputs or are standard join keys needed to connect the provided tables.
+- Enforce the "Known Join Keys and Schema Hints" given with the query; rewrite anything that contradicts them (e.g., a location field on the wrong table), provided the needed columns are available in the inputs or are standard join keys needed to connect the provided tables.
+- If a location field is referenced on the wrong table (e.g., orders.city, orders.state), replace it with customer.customer_city / customer.customer_state AND add the join orders.customer_id = customer.customer_id.
 - Apply "Applicable filters" exactly as given (e.g., "between 2017-01-01 and 2017-01-31", ">= 5", "delivered"). Do not add or remove filters.
 
 COLUMN & ALIAS POLICY
@@ -342,17 +454,15 @@ COLUMN & ALIAS POLICY
 
 AGGREGATION & DISTINCT
 - When counting logical entities that may repeat across rows (e.g., multiple items per order in order_items), prefer COUNT(DISTINCT <entity_id>) to match the intended entity-level count.
-- For seller-level order counts derived from order_items, the query must use COUNT(DISTINCT order_id) grouped by seller_id; if not, rewrite it accordingly.
 
 ROBUSTNESS
 - For grouped results or counts with filters, use subqueries/CTEs where needed to avoid conflicts between GROUP BY, HAVING, and aggregates.
-- For “average delivery time”, default to TIMESTAMPDIFF(DAY, order_purchase_timestamp, order_delivered_customer_date) with NULL filtering unless the user asked for hours.
 
 Return ONLY the final SQL statement.
 """),
     ("human", '''
-**User Question:**
-{query}
+**Known Join Keys and Schema Hints:**
+{schema_hints}
 
 **Relevant Tables and Columns:**
 {columns}
@@ -362,48 +472,51 @@ Return ONLY the final SQL statement.
 
 **SQL Query to Validate:**
 {sql_query}
+
+**User Question:**
+{query}
 ''')
-])
-
-chain_query_validator = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"],
-        "filters": lambda x: x["filters"],
-        "sql_query": lambda x: x["sql_query"],
-    })
-    | template_validation
-    | llm
-    | StrOutputParser()
+]
+
+chain_query_validator = CachedChain(
+    "validation",
+    lambda: _build_chain(messages_validation),
 )
 
 # ========================================
 # Customer Agent graph 
 # ========================================
 # Loads the knowledgebase (per-table descriptions + columns) produced by
-# build_knowledgebase.py. Includes robust fallbacks to locate the pickle.
-_KB_PATH = get_knowledgebase_path()
-try:
-    with open(_KB_PATH, "rb") as f:
-        loaded_dict = pickle.load(f)
-except FileNotFoundError:
-    # Fallback 1: local CWD; Fallback 2: alongside this file
-    candidates = [
-        os.path.join(os.getcwd(), "knowledgebase.pkl"),
-        os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledgebase.pkl"),
-    ]
-    for cand in candidates:
-        try:
-            with open(cand, "rb") as f:
-                loaded_dict = pickle.load(f)
-                break
-        except FileNotFoundError:
-            continue
-    else:
-        # Surface a clear error including attempted paths
+# build_knowledgebase.py on first use, from config.get_knowledgebase_path().
+# Prefers the memory-mapped Arrow file; legacy pickles still load.
+
+
+@lru_cache(maxsize=1)
+def _load_knowledgebase() -> tuple[Mapping, str]:
+    """Return (knowledgebase, version). The version identifies the loaded file
+    build (name, size, mtime); rebuilding the file changes it, which
+    invalidates caches keyed on it (see nlq_to_viz_workflow.answer)."""
+    from knowledgebase import load_knowledgebase  # pulls in pyarrow; keep off the import path
+
+    kb_path = get_knowledgebase_path()
+    try:
+        st = os.stat(kb_path)
+    except FileNotFoundError:
         raise FileNotFoundError(
-            f"knowledgebase.pkl not found at { _KB_PATH } or fallbacks { candidates }"
-        )
+            f"knowledgebase not found at {kb_path}; run build_knowledgebase.py or set KNOWLEDGEBASE_PATH"
+        ) from None
+    return load_knowledgebase(kb_path), f"{os.path.basename(kb_path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def get_knowledgebase() -> Mapping:
+    """{table: (description, columns, columns_json)}, loaded on first call."""
+    return _load_knowledgebase()[0]
+
+
+def get_kb_version() -> str:
+    """Version string of the loaded knowledgebase file."""
+    return _load_knowledgebase()[1]
+
 
 # Router groups -> concrete tables to include for subquestion/column selection
 AGENT_TABLES = {
@@ -413,14 +526,14 @@ AGENT_TABLES = {
 }
 
 
-class OverallState(TypedDict):
-    """State passed through the LangGraph for subquestion & column extraction."""
+class OverallState(TypedDict, total=False):
+    """State passed through the subquestion & column extraction steps."""
     user_query: str
     table_lst: List[str]
     # NOTE: these inner lists are like [subquestion, table_name]
-    table_extract: Annotated[list[str], add]
+    table_extract: list[list[str]]
     # NOTE: downstream contains rows like ["name of table:<t>", "<col>", "<why>"]
-    column_extract: Annotated[list[str], add]
+    column_extract: list[list[str]]
 
 
 def _agent_subquestion(q: str, v: str) -> str:
@@ -432,46 +545,114 @@ def _agent_subquestion(q: str, v: str) -> str:
     return chain_subquestion.invoke({"tables": v, "user_query": q}).replace("\n", "")
 
 
+@lru_cache(maxsize=32)
+def _tables_payload(tables: tuple[str, ...]) -> str:
+    """JSON table -> description object for a (sorted) tuple of tables.
+    Memoized so the prompt text is built once and stays byte-identical."""
+    kb = get_knowledgebase()
+    return to_json({t: kb[t][0] for t in tables})
+
+
+@lru_cache(maxsize=32)
+def _columns_payload(table_name: str) -> str:
+    """JSON column list for one table, pre-serialized in the knowledgebase.
+    Memoized so the Arrow row is not re-materialized on every call."""
+    return get_knowledgebase()[table_name][2]
+
+
 def _solve_subquestion(q: str, lst: List[str]) -> str:
     """Build a minimal table -> description dict for the selected list of tables
     and ask the LLM to split the question into subquestions and assign tables."""
-    pairs = {t: loaded_dict[t][0] for t in lst}
-    return _agent_subquestion(q, str(pairs))
+    return _agent_subquestion(q, _tables_payload(tuple(sorted(lst))))
+
+
+# Subquestion and column replies must be a JSON array of 2-item string arrays.
+_validate_pair_list = fastjsonschema.compile({
+    "type": "array",
+    "items": {"type": "array", "minItems": 2, "maxItems": 2, "items": {"type": "string"}},
+})
+
+
+def _checked_pairs(text: str) -> list | None:
+    """Parsed pair list, or None when the reply breaks the output contract."""
+    parsed = parse_nested_list(text)
+    if not parsed and strip_code_fences(text.strip()) not in ("", "[]"):
+        return None
+    try:
+        _validate_pair_list(parsed)
+    except fastjsonschema.JsonSchemaException:
+        return None
+    return parsed
+
+
+def _parse_pairs(raw: str, text: str | None = None) -> list:
+    """Parse a pair-list reply (text: pre-extracted array, defaults to raw).
+    If it breaks the contract, raw goes through chain_json_repair; if the
+    repair fails too, fall back to the lenient parse of text."""
+    text = raw if text is None else text
+    parsed = _checked_pairs(text)
+    if parsed is None:
+        parsed = _checked_pairs(chain_json_repair.invoke({"raw": raw}))
+    return parsed if parsed is not None else parse_nested_list(text)
 
 
 def _sq_node(state: OverallState):
-    """LangGraph node: compute subquestions mapped to tables and normalize."""
+    """Step 1: compute subquestions mapped to tables and normalize."""
     q = state["user_query"]
     lst = state["table_lst"]
     raw = _solve_subquestion(q, lst) or "[]"
-    parsed = parse_nested_list(raw)
+    parsed = _parse_pairs(raw)
     return {"table_extract": normalize_subquestions(parsed)}
 
 
-def _agent_column_selection(mq: str, q: str, c: str) -> str:
-    """Run column selection chain and extract the first top-level JSON array.
-    Uses a regex to capture [[...],[...],...] blocks if extra text slips in."""
-    resp = chain_column_extractor.invoke({
-        "columns": c, "query": q, "main_question": mq
-    }).replace("\n", "")
-    m = re.search(r"\[\s*\[.*?\]\s*(,\s*\[.*?\]\s*)*\]", resp, re.DOTALL)
-    return m.group(0) if m else "[]"
-
-
-def _solve_column_selection(main_q: str, list_sub: list[list[str]]) -> list[list[str]]:
-    """For each [subquestion, table] select the most relevant columns using the
-    knowledgebase for that table, then assemble rows of the form:
-    ["name of table:<table>", "<column>", "<reason>"]
+def _extract_column_array(resp: str) -> str:
+    """Return the JSON array text from a column-selection reply.
+    The reply is used as-is when it already parses as a JSON array; otherwise a
+    regex captures the first [[...],[...],...] block if extra text slipped in.
+    With no such block the stripped reply is returned, for _parse_pairs to repair."""
+    resp = resp.replace("\n", "")
+    body = strip_code_fences(resp)
+    try:
+        if isinstance(orjson.loads(body), list):
+            return body
+    except orjson.JSONDecodeError:
+        pass
+    m = NESTED_LIST_RE.search(resp)
+    return m.group(0) if m else body
+
+
+def _column_requests(main_q: str, list_sub: list[list[str]]) -> tuple[list[str], list[dict]]:
+    """Column-chain inputs for [subquestion, table] rows, one per table.
+
+    Duplicate (table, subquestion) rows are dropped, and the remaining
+    subquestions for the same table are merged (" | "-joined) into a single
+    request, so there is one LLM call per table. Tables keep first-seen order.
     """
-    final_col: list[list[str]] = []
+    by_table: dict[str, list[str]] = {}
+    seen: set[tuple[str, str]] = set()
     for tab in list_sub:
         if not tab:
             continue
         table_name = tab[-1]
         question = " | ".join(tab[:-1]) or ""
-        columns = loaded_dict[table_name][1]
-        out_column = _agent_column_selection(main_q, question, str(columns))
-        trans_col = parse_nested_list(out_column)
+        key = (table_name, normalize_text(question))
+        if key in seen:
+            continue
+        seen.add(key)
+        by_table.setdefault(table_name, []).append(question)
+    tables = list(by_table)
+    inputs = [
+        {"columns": _columns_payload(table_name), "query": " | ".join(qs), "main_question": main_q}
+        for table_name, qs in by_table.items()
+    ]
+    return tables, inputs
+
+
+def _assemble_columns(tables: list[str], parsed: list[list]) -> list[list[str]]:
+    """Rows of the form ["name of table:<table>", "<column>", "<reason>"]
+    from each table's parsed [[column, reason], ...] list."""
+    final_col: list[list[str]] = []
+    for table_name, trans_col in zip(tables, parsed):
         for col_selec in trans_col:
             if not isinstance(col_selec, list) or len(col_selec) < 2:
                 continue
@@ -479,20 +660,43 @@ def _solve_column_selection(main_q: str, list_sub: list[list[str]]) -> list[list
     return final_col
 
 
+def _solve_column_selection(main_q: str, list_sub: list[list[str]]) -> list[list[str]]:
+    """For each [subquestion, table] select the most relevant columns using the
+    knowledgebase for that table (see _column_requests for the request shape).
+
+    All requests go to the column chain in one batch call: cached ones are
+    served locally and the rest run concurrently (bounded by LLM_MAX_CONCURRENCY).
+    """
+    tables, inputs = _column_requests(main_q, list_sub)
+    if not inputs:
+        return []
+    outs = chain_column_extractor.batch(inputs, config={"max_concurrency": LLM_MAX_CONCURRENCY})
+    return _assemble_columns(tables, [_parse_pairs(r, _extract_column_array(r)) for r in outs])
+
+
 def _column_node(state: OverallState):
-    """LangGraph node: run column selection over subquestions."""
+    """Step 2: run column selection over subquestions."""
     subq = state["table_extract"]
     mq = state["user_query"]
     o = _solve_column_selection(mq, subq)
     return {"column_extract": o}
 
 
-# --- Build a tiny 2-node graph: subquestions -> column selection ---
-_builder = StateGraph(OverallState)
-_builder.add_node("subquestion", _sq_node)
-_builder.add_node("column_e", _column_node)
-_builder.add_edge(START, "subquestion")
-_builder.add_edge("subquestion", "column_e")
-_builder.add_edge("column_e", END)
-# Compiled callable graph
-graph_final = _builder.compile()
+# --- Fixed linear path: subquestions -> column selection ---
+# Plain function calls; a StateGraph only added per-step dispatch and reducer
+# bookkeeping here. Reintroduce LangGraph if branching/retries are needed.
+def run_graph(state: OverallState) -> OverallState:
+    """Run the subquestion step, then column selection, returning the merged state."""
+    out: OverallState = {**state, **_sq_node(state)}
+    out.update(_column_node(out))
+    return out
+
+
+class _LinearGraph:
+    """Keeps the compiled-graph call shape (graph_final.invoke(state))."""
+
+    def invoke(self, state: OverallState, config=None) -> OverallState:
+        return run_graph(state)
+
+
+graph_final = _LinearGraph()
@@ -1,21 +1,21 @@
 # =============================================================================
 # build_knowledgebase.py — Introspects the live MySQL database to gather
 # column names/dtypes/samples per table and asks the LLM to write practical
-# descriptions. Writes a pickle: {table_name: [table_desc, [[col, desc], ...]]}
+# descriptions. Writes an Arrow IPC file (see knowledgebase.py):
+# {table_name: [table_desc, [[col, desc], ...]]}
 # =============================================================================
 
 import os
 import json
 import time
-import pickle
 import tqdm
 import pandas as pd
 from sqlalchemy import text
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableMap
 from langchain_core.output_parsers import StrOutputParser
 
 from config import get_llm, get_engine
+from knowledgebase import write_knowledgebase
 
 # ---- LLM & DB (centralized) ----
 llm = get_llm()
@@ -112,16 +112,7 @@ Return ONLY JSON with keys "table_description" and "columns" as specified.
 """)
 ])
 
-chain = (
-    RunnableMap({
-        "table_desc": lambda x: x["table_desc"],
-        "column_specs": lambda x: x["column_specs"],
-        "table_samples": lambda x: x["table_samples"]
-    })
-    | template
-    | llm
-    | StrOutputParser()
-)
+chain = template | llm | StrOutputParser()
 
 kb_final = {}
 for table, tdesc in tqdm.tqdm(table_description.items()):
@@ -152,10 +143,9 @@ for table, tdesc in tqdm.tqdm(table_description.items()):
     kb_final[table] = [table_desc_final, columns_pairs]
     time.sleep(0.5)  # small delay to be gentle on the API/DB
 
-# Write knowledgebase.pkl next to this file (or at configured path via config)
+# Write knowledgebase.arrow next to this file (memory-mapped by agents.py)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-OUT_PATH = os.path.join(BASE_DIR, "knowledgebase.pkl")
-with open(OUT_PATH, "wb") as f:
-    pickle.dump(kb_final, f)
+OUT_PATH = os.path.join(BASE_DIR, "knowledgebase.arrow")
+write_knowledgebase(kb_final, OUT_PATH)
 
 print(f"✅ Wrote knowledgebase to: {OUT_PATH}  (tables: {len(kb_final)})")
\ No newline at end of file
@@ -5,8 +5,11 @@
 
 import os
 from functools import lru_cache
+from typing import TYPE_CHECKING
 from sqlalchemy import create_engine
-from langchain_openai import AzureChatOpenAI
+
+if TYPE_CHECKING:
+    from langchain_openai import AzureChatOpenAI
 
 # --- Load .env (so your .env file is actually used) ---
 try:
@@ -37,17 +40,35 @@ DB_URL = os.getenv(
 )
 
 # --- Knowledgebase path (optional override via .env) ---
-DEFAULT_KB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledgebase.pkl")
-KNOWLEDGEBASE_PATH = os.getenv("KNOWLEDGEBASE_PATH", DEFAULT_KB)
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KB = os.path.join(PROJECT_DIR, "knowledgebase.arrow")
+LEGACY_KB = os.path.join(PROJECT_DIR, "knowledgebase.pkl")
+KNOWLEDGEBASE_PATH = os.getenv("KNOWLEDGEBASE_PATH")
+
+# --- LLM response cache (see llm_cache.py); LLM_CACHE_MAXSIZE=0 disables it ---
+LLM_CACHE_MAXSIZE = int(os.getenv("LLM_CACHE_MAXSIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))  # seconds
+
+# --- Max concurrent LLM calls when fanning out independent chain calls ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# --- Distinct-value lookups for fuzzy filter matching (see utils._choices_index) ---
+DISTINCT_VALUES_TTL = int(os.getenv("DISTINCT_VALUES_TTL", "3600"))  # seconds, Streamlit only
+DISTINCT_VALUES_MAX_ENTRIES = int(os.getenv("DISTINCT_VALUES_MAX_ENTRIES", "256"))
+DISTINCT_VALUES_LIMIT = int(os.getenv("DISTINCT_VALUES_LIMIT", "50000"))  # max values fetched per column
 
 
 @lru_cache(maxsize=1)
-def get_llm() -> AzureChatOpenAI:
+def get_llm() -> "AzureChatOpenAI":
     """Singleton AzureChatOpenAI configured exactly like your original code.
 
+    langchain_openai is imported here rather than at module level so that
+    importing config stays cheap until an LLM is actually needed.
+
     NOTE: Ensure AZURE_ENDPOINT is the base resource URL (see note above) for
     best compatibility with langchain_openai.
     """
+    from langchain_openai import AzureChatOpenAI
     return AzureChatOpenAI(
         azure_endpoint=AZURE_ENDPOINT,
         azure_deployment=AZURE_DEPLOYMENT,
@@ -64,5 +85,12 @@ def get_engine():
 
 @lru_cache(maxsize=1)
 def get_knowledgebase_path() -> str:
-    """Path to knowledgebase.pkl; uses .env override when provided."""
-    return KNOWLEDGEBASE_PATH
+    """Path to the knowledgebase, resolved once: the .env override when provided,
+    else knowledgebase.arrow next to this file, else a legacy knowledgebase.pkl
+    there. The path is returned even if the file is missing, so the loader can
+    report it."""
+    if KNOWLEDGEBASE_PATH:
+        return KNOWLEDGEBASE_PATH
+    if not os.path.exists(DEFAULT_KB) and os.path.exists(LEGACY_KB):
+        return LEGACY_KB
+    return DEFAULT_KB
@@ -0,0 +1,95 @@
+# =============================================================================
+# knowledgebase.py — On-disk format for the knowledgebase built by
+# build_knowledgebase.py. Loaded entries are
+#   {table_name: (table_desc, [[col, desc], ...], columns_json)}
+# Stored as an Arrow IPC file and memory-mapped on load, so worker processes
+# share one page-cache copy instead of each unpickling its own Python objects.
+# columns_json is the column list pre-serialized at build time, so prompt
+# payloads are never re-stringified per request and stay byte-stable.
+# Legacy knowledgebase.pkl files are still readable.
+#
+# Convert an existing pickle:  python knowledgebase.py knowledgebase.pkl
+# =============================================================================
+
+from __future__ import annotations
+import os
+import pickle
+import sys
+from collections.abc import Mapping
+
+import orjson
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+KB_SCHEMA = pa.schema([
+    ("table", pa.string()),
+    ("description", pa.string()),
+    ("columns", pa.list_(pa.list_(pa.string()))),
+    ("columns_json", pa.string()),
+])
+
+
+def columns_json(columns) -> str:
+    """Canonical JSON text for a table's [[col, desc], ...] list."""
+    return orjson.dumps(columns, option=orjson.OPT_SORT_KEYS).decode()
+
+
+def write_knowledgebase(kb: dict, path: str) -> None:
+    """Write {table: [desc, [[col, desc], ...]]} as an Arrow IPC file."""
+    names = list(kb)
+    columns = [[[str(x) for x in pair] for pair in kb[t][1]] for t in names]
+    arrow_table = pa.table({
+        "table": names,
+        "description": [str(kb[t][0]) for t in names],
+        "columns": columns,
+        "columns_json": [columns_json(c) for c in columns],
+    }, schema=KB_SCHEMA)
+    with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, KB_SCHEMA) as writer:
+        writer.write_table(arrow_table)
+
+
+class ArrowKnowledgebase(Mapping):
+    """Read-only mapping over a memory-mapped Arrow knowledgebase.
+
+    Rows are materialized lazily:
+      kb[table] -> (description, [[col, desc], ...], columns_json)
+    Files written before columns_json existed get it computed on access.
+    """
+
+    def __init__(self, path: str):
+        self._table = ipc.open_file(pa.memory_map(path, "r")).read_all()
+        self._index = {name: i for i, name in enumerate(self._table.column("table").to_pylist())}
+        self._has_json = "columns_json" in self._table.column_names
+
+    def __getitem__(self, table_name: str):
+        i = self._index[table_name]
+        columns = self._table.column("columns")[i].as_py()
+        return (
+            self._table.column("description")[i].as_py(),
+            columns,
+            self._table.column("columns_json")[i].as_py() if self._has_json else columns_json(columns),
+        )
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+def load_knowledgebase(path: str) -> Mapping:
+    """Load a knowledgebase by extension: .arrow (memory-mapped) or legacy pickle.
+    Raises FileNotFoundError if the path does not exist."""
+    if path.endswith(".arrow"):
+        return ArrowKnowledgebase(path)
+    with open(path, "rb") as f:
+        raw = pickle.load(f)
+    return {t: (v[0], v[1], columns_json(v[1])) for t, v in raw.items()}
+
+
+if __name__ == "__main__":
+    # One-off conversion of a legacy pickle to the Arrow format.
+    src = sys.argv[1] if len(sys.argv) > 1 else "knowledgebase.pkl"
+    dst = os.path.splitext(src)[0] + ".arrow"
+    write_knowledgebase(load_knowledgebase(src), dst)
+    print(f"✅ Wrote knowledgebase to: {dst}")
@@ -0,0 +1,156 @@
+# =============================================================================
+# llm_cache.py — In-process response cache for the LLM chains. Keys are a
+# canonical SHA-256 over (deployment, template name, prompt inputs); entries
+# expire after a TTL and are evicted least-recently-used once the cache is full.
+# =============================================================================
+
+from __future__ import annotations
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import orjson
+
+from config import AZURE_DEPLOYMENT, LLM_CACHE_MAXSIZE, LLM_CACHE_TTL
+from utils import normalize_text
+
+
+def cache_key(template_name: str, inputs: dict) -> str:
+    """Canonical hash of a chain call: same deployment + template + inputs → same key."""
+    payload = orjson.dumps(
+        {"model": AZURE_DEPLOYMENT, "tpl": template_name, "inputs": inputs},
+        option=orjson.OPT_SORT_KEYS,
+        default=str,
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+
+class LLMCache:
+    """Thread-safe TTL + LRU mapping of cache key -> chain output.
+
+    maxsize <= 0 disables the cache (every get misses, set is a no-op).
+    """
+
+    def __init__(self, maxsize: int = LLM_CACHE_MAXSIZE, ttl: float = LLM_CACHE_TTL):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# Shared by every CachedChain unless one is passed explicitly.
+default_cache = LLMCache()
+
+
+class CachedChain:
+    """Wraps a LangChain runnable so identical prompt inputs skip the LLM call.
+
+    build: zero-arg factory for the runnable. It is called on first use, so
+    defining a CachedChain does not import LangChain or create the LLM client.
+
+    normalize: input fields (typically free-text questions) that are
+    lowercased and whitespace-collapsed for the cache key only, so trivially
+    different phrasings share an entry; the prompt still gets the raw text.
+
+    Only non-empty outputs are stored, so a transient empty/failed response is
+    retried on the next call instead of being pinned in the cache.
+    """
+
+    def __init__(self, name: str, build: Callable[[], Any], cache: Optional[LLMCache] = None,
+                 normalize: tuple[str, ...] = ()):
+        self.name = name
+        self.cache = cache if cache is not None else default_cache
+        self.normalize = normalize
+        self._build = build
+        self._chain = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def chain(self):
+        """The underlying runnable, built on first access."""
+        if self._chain is None:
+            with self._build_lock:
+                if self._chain is None:
+                    self._chain = self._build()
+        return self._chain
+
+    def _key(self, inputs: dict) -> str:
+        if self.normalize:
+            inputs = {k: normalize_text(v) if k in self.normalize else v for k, v in inputs.items()}
+        return cache_key(self.name, inputs)
+
+    def invoke(self, inputs: dict, config=None, **kwargs):
+        key = self._key(inputs)
+        hit = self.cache.get(key)
+        if hit is not None:
+            return hit
+        resp = self.chain.invoke(inputs, config=config, **kwargs)
+        if resp:
+            self.cache.set(key, resp)
+        return resp
+
+    def stream_until(self, inputs: dict, complete: Callable[[str], Optional[str]], config=None) -> str:
+        """Stream the chain and stop reading as soon as complete(buffer) returns
+        the finished text, so trailing tokens are not waited on. Returns the
+        full output if complete() never fires. The returned text is cached."""
+        key = self._key(inputs)
+        hit = self.cache.get(key)
+        if hit is not None:
+            return hit
+        buf = ""
+        done = None
+        for chunk in self.chain.stream(inputs, config=config):
+            buf += chunk
+            done = complete(buf)
+            if done is not None:
+                break
+        resp = done if done is not None else buf
+        if resp:
+            self.cache.set(key, resp)
+        return resp
+
+    def batch(self, inputs: list[dict], config=None, **kwargs) -> list:
+        """Cached counterpart of Runnable.batch: cache hits are answered locally,
+        and only the distinct misses go to the underlying chain's batch (which
+        runs them concurrently, bounded by config["max_concurrency"])."""
+        keys = [self._key(x) for x in inputs]
+        results = [self.cache.get(k) for k in keys]
+        pending: dict[str, dict] = {}
+        for k, x, r in zip(keys, inputs, results):
+            if r is None and k not in pending:
+                pending[k] = x
+        if pending:
+            resps = self.chain.batch(list(pending.values()), config=config, **kwargs)
+            fresh = dict(zip(pending, resps))
+            for k, resp in fresh.items():
+                if resp:
+                    self.cache.set(k, resp)
+            results = [fresh[k] if r is None else r for k, r in zip(keys, results)]
+        return results
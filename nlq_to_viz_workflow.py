@@ -10,18 +10,24 @@
 
 from __future__ import annotations
 from typing import TypedDict, List, Any
-import ast, json
+import ast
+import hashlib
 import pandas as pd
 
 from agents import (
     agent_router,
     graph_final as customer_graph,
     AGENT_TABLES,
+    get_kb_version,
     chain_filter_extractor,
     chain_query_extractor,
     chain_query_validator,     # <--  import validator
+    schema_hints_for,
+    static_sql_ok,
 )
-from utils import parse_nested_list, fuzzy_match_filters
+from llm_cache import LLMCache
+from sql_templates import match_template
+from utils import parse_nested_list, fuzzy_match_filters, first_sql_statement, to_json, normalize_question
 from sql_viz_workflow import run_workflow as run_sql_viz  # validates SQL, executes, BI, viz gen/validate
 
 
@@ -64,7 +70,7 @@ def _pick_tables_for_question(question: str) -> List[str]:
 
 
 def _subquestions_and_columns(question: str, tables: List[str]) -> list[list]:
-    """Invoke the LangGraph that produces column selections from subquestions."""
+    """Run the subquestion -> column selection steps (agents.graph_final)."""
     st = customer_graph.invoke({"user_query": question, "table_lst": tables})
     return st.get("column_extract", []) or []
 
@@ -96,23 +102,30 @@ def _filters(question: str, columns_selected: list):
     return raw, raw
 
 
-def _generate_sql(question: str, columns_selected: list, filters_any) -> str:
-    """Generate SQL from context; returns a single SELECT statement as text."""
-    filters_str = json.dumps(filters_any) if isinstance(filters_any, (list, dict)) else str(filters_any)
-    sql = chain_query_extractor.invoke({
+def _generate_sql(question: str, tables: List[str], columns_selected: list, filters_any) -> str:
+    """Generate SQL from context; returns a single SELECT statement as text.
+
+    The response is streamed and reading stops at the first complete
+    (';'-terminated) statement, so validation can start without waiting for
+    any trailing tokens the model emits after the query.
+    """
+    filters_str = to_json(filters_any) if isinstance(filters_any, (list, dict)) else str(filters_any)
+    sql = chain_query_extractor.stream_until({
         "query": question,
+        "schema_hints": schema_hints_for(tables),
         "columns": str(columns_selected),
         "filters": filters_str
-    }).strip()
+    }, first_sql_statement).strip()
     return sql
 
 
 # --- validator step before execution ---
-def _validate_sql(question: str, columns_selected: list, filters_any, sql_text: str) -> str:
+def _validate_sql(question: str, tables: List[str], columns_selected: list, filters_any, sql_text: str) -> str:
     """Run SQL through the validator/fixer before execution."""
-    filters_str = json.dumps(filters_any) if isinstance(filters_any, (list, dict)) else str(filters_any)
+    filters_str = to_json(filters_any) if isinstance(filters_any, (list, dict)) else str(filters_any)
     sql_valid = chain_query_validator.invoke({
         "query": question,
+        "schema_hints": schema_hints_for(tables),
         "columns": str(columns_selected),
         "filters": filters_str,
         "sql_query": sql_text
@@ -120,11 +133,38 @@ def _validate_sql(question: str, columns_selected: list, filters_any, sql_text:
     return sql_valid or sql_text
 
 
-def run(question: str, *, max_retries: int = 3) -> FinalState:
-    """End-to-end run producing SQL, DataFrame, and viz artifacts.
+# Exact cache: normalized question -> SQL plan whose SQL executed successfully.
+# Keyed with the KB version so a knowledgebase rebuild invalidates every entry.
+FINAL_SQL_CACHE = LLMCache()
 
-    max_retries governs how many times SQL and viz code are auto-fixed.
+
+def _final_sql_key(question: str) -> str:
+    return hashlib.sha256(f"{normalize_question(question)}\x00{get_kb_version()}".encode("utf-8")).hexdigest()
+
+
+def answer(question: str) -> dict:
+    """Question -> {"sql", "columns_selected", "filters_raw", "filters_matched"}.
+
+    Served from FINAL_SQL_CACHE when the same (normalized) question already
+    produced SQL that executed, or from sql_templates when the question is a
+    known filter-free pattern (no LLM calls); otherwise runs router -> subquestions/columns
+    -> filters -> SQL generation -> validation (skipped when static_sql_ok
+    passes). run() writes the cache.
     """
+    hit = FINAL_SQL_CACHE.get(_final_sql_key(question))
+    if hit is not None:
+        return dict(hit)
+
+    tpl = match_template(question)
+    if tpl is not None:
+        _, sql, columns_selected = tpl
+        return {
+            "sql": sql,
+            "columns_selected": columns_selected,
+            "filters_raw": '["no"]',
+            "filters_matched": '["no"]',
+        }
+
     tables = _pick_tables_for_question(question)
 
     # De-dupe before downstream usage
@@ -134,18 +174,38 @@ def run(question: str, *, max_retries: int = 3) -> FinalState:
     # Filters over deduped columns
     filters_raw, filters_matched = _filters(question, columns_selected)
 
-    # Generate then validate SQL (pre-execution)
-    sql_raw = _generate_sql(question, columns_selected, filters_matched)
-    sql = _validate_sql(question, columns_selected, filters_matched, sql_raw)
+    # Generate SQL; the LLM validator only runs when the static pre-check fails
+    sql = _generate_sql(question, tables, columns_selected, filters_matched)
+    if not static_sql_ok(sql, tables):
+        sql = _validate_sql(question, tables, columns_selected, filters_matched, sql)
+    return {
+        "sql": sql,
+        "columns_selected": columns_selected,
+        "filters_raw": filters_raw,
+        "filters_matched": filters_matched,
+    }
+
+
+def run(question: str, *, max_retries: int = 3) -> FinalState:
+    """End-to-end run producing SQL, DataFrame, and viz artifacts.
+
+    max_retries governs how many times SQL and viz code are auto-fixed.
+    """
+    plan = answer(question)
+    columns_selected = plan["columns_selected"]
+    filters_raw, filters_matched = plan["filters_raw"], plan["filters_matched"]
 
     # Execute + BI/Viz
     state = run_sql_viz(
         question=question,
-        sql=sql,
+        sql=plan["sql"],
         columns=str(columns_selected),
-        filters=json.dumps(filters_matched) if not isinstance(filters_matched, str) else filters_matched,
+        filters=to_json(filters_matched) if not isinstance(filters_matched, str) else filters_matched,
         max_retries=max_retries
     )
+    # Write-through only SQL that actually ran (possibly after the fixer).
+    if state.get("result_debug_sql") == "Pass":
+        FINAL_SQL_CACHE.set(_final_sql_key(question), {**plan, "sql": state["sql"]})
 
     combined: FinalState = {
         "question": question,
@@ -0,0 +1,140 @@
+# =============================================================================
+# sql_templates.py — Deterministic SQL for common Olist questions.
+# Each entry pairs a regex over the normalized question (utils.normalize_question:
+# lowercase, no punctuation, single spaces) with a parameterized MySQL query.
+# Patterns must match the WHOLE question, so anything carrying extra
+# constraints (dates, states, categories, ...) falls through to the LLM
+# pipeline, which handles filters. Named groups fill the template's {fields};
+# TEMPLATE_DEFAULTS covers groups that did not participate in the match.
+# =============================================================================
+
+from __future__ import annotations
+import re
+from typing import Optional
+
+from utils import normalize_question
+
+TEMPLATE_DEFAULTS = {"n": "1"}
+
+# "which seller ..." -> LIMIT 1; "top N sellers ..." (N >= 1) -> LIMIT N.
+# Plural nouns without a number ("which sellers ...") match neither branch and
+# fall through to the LLM, which picks its own limit.
+_SELLER_OR_TOP_N = r"(?:(?:which|what) seller|top (?P<n>[1-9]\d*) sellers)"
+
+# (name, pattern, sql, [(table, column), ...] the SQL reads)
+TEMPLATES = [
+    (
+        "payment_type_usage",
+        r"(?:which|what) payment (?:type|method) is (?:the )?most (?:used|common|popular)"
+        r"|(?:what is )?the most (?:used|common|popular) payment (?:type|method)"
+        r"|(?:number of )?payments (?:by|per) payment (?:type|method)",
+        "SELECT payment_type, COUNT(*) AS payment_count\n"
+        "FROM order_payments\n"
+        "GROUP BY payment_type\n"
+        "ORDER BY payment_count DESC;",
+        [("order_payments", "payment_type")],
+    ),
+    (
+        "top_sellers_by_orders",
+        _SELLER_OR_TOP_N + r" (?:received|has|have|got|with) the most orders",
+        "SELECT order_items.seller_id, COUNT(DISTINCT order_items.order_id) AS order_count\n"
+        "FROM order_items\n"
+        "GROUP BY order_items.seller_id\n"
+        "ORDER BY order_count DESC\n"
+        "LIMIT {n};",
+        [("order_items", "seller_id"), ("order_items", "order_id")],
+    ),
+    (
+        "monthly_revenue",
+        r"(?:show |what is |what are )?(?:the )?(?:monthly (?:revenue|sales)|(?:revenue|sales) (?:by|per) month)"
+        r"(?: trend)?(?: over time)?",
+        "SELECT DATE_FORMAT(orders.order_purchase_timestamp, '%Y-%m') AS month,\n"
+        "       SUM(order_payments.payment_value) AS revenue\n"
+        "FROM orders\n"
+        "JOIN order_payments ON orders.order_id = order_payments.order_id\n"
+        "GROUP BY month\n"
+        "ORDER BY month;",
+        [("orders", "order_purchase_timestamp"), ("orders", "order_id"),
+         ("order_payments", "order_id"), ("order_payments", "payment_value")],
+    ),
+    (
+        "monthly_orders",
+        r"(?:show |what is |how many )?(?:the )?(?:monthly (?:orders|order count)|(?:number of orders|orders|order count) (?:by|per) month)"
+        r"(?: trend)?(?: over time)?",
+        "SELECT DATE_FORMAT(orders.order_purchase_timestamp, '%Y-%m') AS month,\n"
+        "       COUNT(DISTINCT orders.order_id) AS order_count\n"
+        "FROM orders\n"
+        "GROUP BY month\n"
+        "ORDER BY month;",
+        [("orders", "order_purchase_timestamp"), ("orders", "order_id")],
+    ),
+    (
+        "total_revenue",
+        r"(?:what is )?(?:the )?total (?:revenue|sales)(?: amount)?",
+        "SELECT SUM(order_payments.payment_value) AS total_revenue\n"
+        "FROM order_payments;",
+        [("order_payments", "payment_value")],
+    ),
+    (
+        "average_delivery_days",
+        r"(?:what is )?(?:the )?average delivery time(?: in days)?",
+        "SELECT AVG(TIMESTAMPDIFF(DAY, orders.order_purchase_timestamp, orders.order_delivered_customer_date))"
+        " AS avg_delivery_days\n"
+        "FROM orders\n"
+        "WHERE orders.order_purchase_timestamp IS NOT NULL\n"
+        "  AND orders.order_delivered_customer_date IS NOT NULL;",
+        [("orders", "order_purchase_timestamp"), ("orders", "order_delivered_customer_date")],
+    ),
+    (
+        "orders_by_customer_state",
+        r"(?:how many orders (?:are there )?|(?:the )?number of orders |orders )(?:by|per|in each|from each) (?:customer )?state",
+        "SELECT customer.customer_state, COUNT(DISTINCT orders.order_id) AS order_count\n"
+        "FROM orders\n"
+        "JOIN customer ON orders.customer_id = customer.customer_id\n"
+        "GROUP BY customer.customer_state\n"
+        "ORDER BY order_count DESC;",
+        [("orders", "order_id"), ("orders", "customer_id"),
+         ("customer", "customer_id"), ("customer", "customer_state")],
+    ),
+    (
+        "average_review_by_category",
+        r"(?:what is )?(?:the )?average review score (?:by|per|for each) (?:product )?category",
+        # DISTINCT per (order, category): an order with several items of one
+        # category counts its review once, not once per item row.
+        "SELECT category, AVG(review_score) AS avg_review_score\n"
+        "FROM (\n"
+        "  SELECT DISTINCT order_reviews.order_id,\n"
+        "         COALESCE(category_translation.product_category_name_english, products.product_category_name) AS category,\n"
+        "         order_reviews.review_score\n"
+        "  FROM order_reviews\n"
+        "  JOIN order_items ON order_reviews.order_id = order_items.order_id\n"
+        "  JOIN products ON order_items.product_id = products.product_id\n"
+        "  LEFT JOIN category_translation\n"
+        "    ON products.product_category_name = category_translation.product_category_name\n"
+        ") AS order_categories\n"
+        "GROUP BY category\n"
+        "ORDER BY avg_review_score DESC;",
+        [("order_reviews", "order_id"), ("order_reviews", "review_score"),
+         ("order_items", "order_id"), ("order_items", "product_id"),
+         ("products", "product_id"), ("products", "product_category_name"),
+         ("category_translation", "product_category_name"),
+         ("category_translation", "product_category_name_english")],
+    ),
+]
+
+_COMPILED = [(name, re.compile(pat), sql, cols) for name, pat, sql, cols in TEMPLATES]
+
+
+def match_template(question: str) -> Optional[tuple[str, str, list[list[str]]]]:
+    """Return (template name, SQL, column rows) if the question matches a
+    template, else None. Column rows use the column-selection shape
+    ["name of table:<table>", "<column>", "<reason>"]."""
+    q = normalize_question(question)
+    for name, pat, sql, cols in _COMPILED:
+        m = pat.fullmatch(q)
+        if m is None:
+            continue
+        params = {**TEMPLATE_DEFAULTS, **{k: v for k, v in m.groupdict().items() if v is not None}}
+        rows = [[f"name of table:{t}", c, f"used by SQL template {name}"] for t, c in cols]
+        return name, sql.format(**params), rows
+    return None
@@ -14,13 +14,12 @@ Notes:
 - The graph is intentionally linear. Each node reads/writes a shared `AgentState`.
 - SQL safety: only SELECTs are allowed and large results are wrapped with a LIMIT.
 - Plotly code must produce exactly one of: `fig`, `df_viz`, or `string_viz_result`.
+- LangChain/LangGraph and the LLM client are loaded on first use, not at import.
 """
 
 from __future__ import annotations
+from functools import lru_cache
 from typing import TypedDict, Dict, Any
-from langgraph.graph import StateGraph, START, END
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from sqlalchemy import text
 import pandas as pd
 import re
@@ -29,9 +28,12 @@ import traceback
 from config import get_llm, get_engine
 from utils import extract_code_block
 
-# Initialize shared singletons once per process
-engine = get_engine()
-llm = get_llm()
+
+def _llm_chain(messages: list):
+    """prompt | shared LLM | str parser, importing LangChain on first use."""
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    return ChatPromptTemplate.from_messages(messages) | get_llm() | StrOutputParser()
 
 # ------------------ Inlined prompts ------------------
 # BI expert prompt – converts a question + df structure into a concise viz recommendation.
@@ -164,9 +166,16 @@ class AgentState(TypedDict):
     python_code_store_variables_dict: dict  # Exec env after running the viz code
 
 
+_SELECT_RE = re.compile(r"(?is)^\s*select\b")
+_TRAILING_LIMIT_RE = re.compile(r"(?is)\blimit\s+\d+\s*$")
+# Viz code clean-up before exec
+_STATE_DF_RE = re.compile(r"state\.get\(\s*['\"]df['\"]\s*\)")
+_FIG_SHOW_RE = re.compile(r"fig\.show\(\)\s*;?")
+
+
 def _only_select(sql: str) -> None:
     """Reject non-SELECT statements up front (defense-in-depth)."""
-    if not re.match(r"(?is)^\s*select\b", sql or ""):
+    if not _SELECT_RE.match(sql or ""):
         raise ValueError("Only SELECT statements are allowed.")
 
 def _wrap_with_limit(sql: str, limit: int = 2000) -> str:
@@ -175,7 +184,7 @@ def _wrap_with_limit(sql: str, limit: int = 2000) -> str:
     end with a LIMIT. This avoids returning massive result sets in Streamlit.
     """
     s = (sql or "").strip().rstrip(";")
-    if re.search(r"(?is)\blimit\s+\d+\s*$", s):
+    if _TRAILING_LIMIT_RE.search(s):
         return s
     return f"SELECT * FROM ({s}) AS t LIMIT {limit}"
 
@@ -185,13 +194,13 @@ def _explain_safe(sql: str) -> None:
     Failures are tolerated — EXPLAIN is best-effort and non-blocking.
     """
     try:
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
             conn.execute(text("EXPLAIN " + sql))
     except Exception:
         pass  # Ignore explain errors; the real execution will surface issues.
 
 # Prompt that attempts to fix a broken SQL using the known context (question/columns/filters).
-_sql_fixer_prompt = ChatPromptTemplate.from_messages([
+_sql_fixer_messages = [
     ("system", """
 You are a precise MySQL query fixer.
 
@@ -221,8 +230,13 @@ Current SQL to fix:
 Database error message:
 {error}
 """)
-])
-_sql_fixer_chain = _sql_fixer_prompt | llm | StrOutputParser()
+]
+
+
+@lru_cache(maxsize=1)
+def _sql_fixer_chain():
+    return _llm_chain(_sql_fixer_messages)
+
 
 # ------------------ Graph nodes ------------------
 def sql_validate_and_execute_node(state: AgentState) -> AgentState:
@@ -262,7 +276,7 @@ def sql_validate_and_execute_node(state: AgentState) -> AgentState:
             state["error_msg_debug_sql"] = err_short
 
             # Ask LLM to fix the SQL in place, then loop again.
-            sql_in = _sql_fixer_chain.invoke({
+            sql_in = _sql_fixer_chain().invoke({
                 "question": state["question"],
                 "columns": state.get("columns", ""),
                 "filters": state.get("filters", ""),
@@ -276,8 +290,7 @@ def bi_expert_node(state: AgentState) -> AgentState:
     Produce a concise “what to plot” recommendation based on the DataFrame and question.
     This is deliberately plain text so the next node can turn it into concrete code.
     """
-    prompt = ChatPromptTemplate.from_messages([("system", system_prompt_agent_bi_expert_node)])
-    chain = prompt | llm | StrOutputParser()
+    chain = _llm_chain([("system", system_prompt_agent_bi_expert_node)])
     df = state.get("df", pd.DataFrame())
     response = chain.invoke({
         "question": state["question"],
@@ -293,10 +306,9 @@ def viz_code_generator_node(state: AgentState) -> AgentState:
     Turn the BI recommendation + df summary into Plotly (or table/text) Python code.
     The subsequent validator will actually run (and fix) that code if needed.
     """
-    prompt = ChatPromptTemplate.from_messages([
+    chain = _llm_chain([
         ("system", system_prompt_agent_python_code_data_visualization_generator_node)
     ])
-    chain = prompt | llm | StrOutputParser()
     df = state.get("df", pd.DataFrame())
     response = chain.invoke({
         "visualization_request": state["visualization_request"],
@@ -307,6 +319,28 @@ def viz_code_generator_node(state: AgentState) -> AgentState:
     state["python_code_data_visualization"] = extract_code_block(response, "python").strip()
     return state
 
+def execute_viz_code(code: str, df: pd.DataFrame | None) -> tuple[str, Dict[str, Any]]:
+    """Run generated viz code against df and return (code as run, exec globals).
+
+    References to `state.get('df')` are rewritten to `df` and `fig.show()`
+    calls are stripped. Exceptions from the code propagate to the caller.
+    """
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    if df is None:
+        df = pd.DataFrame()
+
+    # Make code robust to accidental references to `state.get('df')`.
+    code_to_run = _STATE_DF_RE.sub("df", code)
+    # Ensure non-interactive execution environment.
+    code_to_run = _FIG_SHOW_RE.sub("", code_to_run)
+
+    exec_globals: Dict[str, Any] = {"df": df, "pd": pd, "px": px, "go": go, "state": {"df": df}}
+    exec(code_to_run, exec_globals)
+    return code_to_run, exec_globals
+
+
 def viz_code_validator_node(state: AgentState) -> AgentState:
     """
     Execute the generated code in a controlled namespace:
@@ -323,22 +357,7 @@ def viz_code_validator_node(state: AgentState) -> AgentState:
 
     for attempt in range(state["num_retries_debug_python_code_data_visualization"], state["max_num_retries_debug"] + 1):
         try:
-            import pandas as pd
-            import plotly.express as px
-            import plotly.graph_objects as go
-            import re
-
-            df = state.get("df")
-            if df is None:
-                df = pd.DataFrame()
-
-            # Make code robust to accidental references to `state.get('df')`.
-            code_to_run = re.sub(r"state\.get\(\s*['\"]df['\"]\s*\)", "df", code)
-            # Ensure non-interactive execution environment.
-            code_to_run = re.sub(r"fig\.show\(\)\s*;?", "", code_to_run)
-
-            exec_globals: Dict[str, Any] = {"df": df, "pd": pd, "px": px, "go": go, "state": {"df": df}}
-            exec(code_to_run, exec_globals)
+            code_to_run, exec_globals = execute_viz_code(code, state.get("df"))
 
             # Persist outputs for UI consumption.
             state["python_code_store_variables_dict"] = exec_globals
@@ -355,11 +374,10 @@ def viz_code_validator_node(state: AgentState) -> AgentState:
             err_short = (str(e) + " | " + traceback.format_exc(limit=1))[:800]
             state["error_msg_debug_python_code_data_visualization"] = err_short
 
-            fix_prompt = ChatPromptTemplate.from_messages([
+            chain = _llm_chain([
                 ("system", system_prompt_agent_python_code_data_visualization_validator_node),
                 ("human", "python\n{python_code_data_visualization}\n\nError:\n{error_msg_debug}")
             ])
-            chain = fix_prompt | llm | StrOutputParser()
             fixed = chain.invoke({
                 "python_code_data_visualization": code,
                 "error_msg_debug": err_short
@@ -369,19 +387,23 @@ def viz_code_validator_node(state: AgentState) -> AgentState:
     return state  # Return last failure if all retries exhausted.
 
 # ------------------ Graph wiring ------------------
-graph = StateGraph(AgentState)
-graph.add_node("sql_validate_and_execute", sql_validate_and_execute_node)
-graph.add_node("bi_expert", bi_expert_node)
-graph.add_node("viz_code_generator", viz_code_generator_node)
-graph.add_node("viz_code_validator", viz_code_validator_node)
-
-graph.add_edge(START, "sql_validate_and_execute")
-graph.add_edge("sql_validate_and_execute", "bi_expert")
-graph.add_edge("bi_expert", "viz_code_generator")
-graph.add_edge("viz_code_generator", "viz_code_validator")
-graph.add_edge("viz_code_validator", END)
-
-app = graph.compile()
+@lru_cache(maxsize=1)
+def _app():
+    """Compile the graph on first run (keeps langgraph out of import time)."""
+    from langgraph.graph import StateGraph, START, END
+
+    graph = StateGraph(AgentState)
+    graph.add_node("sql_validate_and_execute", sql_validate_and_execute_node)
+    graph.add_node("bi_expert", bi_expert_node)
+    graph.add_node("viz_code_generator", viz_code_generator_node)
+    graph.add_node("viz_code_validator", viz_code_validator_node)
+
+    graph.add_edge(START, "sql_validate_and_execute")
+    graph.add_edge("sql_validate_and_execute", "bi_expert")
+    graph.add_edge("bi_expert", "viz_code_generator")
+    graph.add_edge("viz_code_generator", "viz_code_validator")
+    graph.add_edge("viz_code_validator", END)
+    return graph.compile()
 
 def run_workflow(
     question: str,
@@ -421,4 +443,4 @@ def run_workflow(
         "error_msg_debug_python_code_data_visualization": "",
         "python_code_store_variables_dict": {},
     }
-    return app.invoke(initial)
+    return _app().invoke(initial)
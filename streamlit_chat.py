@@ -8,12 +8,25 @@ Minimal Streamlit front-end for the NLQ → SQL → Viz pipeline.
 """
 
 # streamlit_chat.py
-import json
+import io
+from typing import Optional
+
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import streamlit as st
 import streamlit.components.v1 as components
 
 from nlq_to_viz_workflow import run as run_full
+from sql_viz_workflow import execute_viz_code
+
+
+def _js_string(s: str) -> str:
+    """JSON string literal for embedding in injected JS (orjson, C-backed)."""
+    return orjson.dumps(s).decode()
+
 
 # Basic page metadata/layout.
 st.set_page_config(page_title="SQL/BI Agent", layout="wide")
@@ -39,6 +52,117 @@ with st.expander("Advanced (optional)"):
         key="max_retries",
     )
 
+# --- Cross-session result cache ---
+# Identical (question, max_retries) runs are served from st.cache_data. The
+# exec namespace (live figure, imported modules) can't be pickled, so it is
+# dropped from the cached value and rebuilt by re-running the validated viz
+# code, which is local and cheap next to the LLM/SQL pipeline.
+# Runs whose SQL did not pass are raised out of the cached function, so
+# st.cache_data stores nothing and the next click retries the pipeline.
+class _UncachedRun(Exception):
+    def __init__(self, state: dict):
+        super().__init__("run did not pass")
+        self.state = state
+
+
+@st.cache_data(ttl=1800, max_entries=128, show_spinner=False)
+def _cached_run_full(question: str, max_retries: int) -> dict:
+    state = run_full(question, max_retries=max_retries)
+    state = {k: v for k, v in state.items() if k != "python_code_store_variables_dict"}
+    if state.get("result_debug_sql") != "Pass":
+        raise _UncachedRun(state)
+    return state
+
+
+def _run_full_cached(question: str, max_retries: int) -> dict:
+    """_cached_run_full, returning failed runs without caching them."""
+    try:
+        return _cached_run_full(question, max_retries)
+    except _UncachedRun as e:
+        return e.state
+
+
+def _with_viz_outputs(state: dict) -> dict:
+    """Re-execute the (already validated) viz code to restore fig/df_viz/text."""
+    state["python_code_store_variables_dict"] = {}
+    if state.get("result_debug_python_code_data_visualization") == "Pass":
+        try:
+            _, state["python_code_store_variables_dict"] = execute_viz_code(
+                state.get("python_code_data_visualization", ""), state.get("df")
+            )
+        except Exception as e:
+            state["result_debug_python_code_data_visualization"] = "Not Pass"
+            state["error_msg_debug_python_code_data_visualization"] = str(e)
+    return state
+
+
+# Content hash for result frames, so download bytes are cached per table content.
+def _df_hash(df: pd.DataFrame):
+    return (df.shape, tuple(map(str, df.columns)), pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+
+# Arrow's CSV writer formats these differently from DataFrame.to_csv
+# (timestamps with nanoseconds, lowercase true/false).
+_CSV_AS_TEXT = {"datetime64", "datetime", "boolean"}
+
+
+def _pandas_csv_text(df: pd.DataFrame) -> pd.DataFrame:
+    """df with datetime/bool columns as the strings to_csv would write (nulls kept)."""
+    out = None
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        if pd.api.types.infer_dtype(col) in _CSV_AS_TEXT:
+            out = df.copy() if out is None else out
+            out.isetitem(i, col.astype(str).where(col.notna()))
+    return df if out is None else out
+
+
+@st.cache_data(show_spinner=False, max_entries=32, hash_funcs={pd.DataFrame: _df_hash})
+def _to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """UTF-8 CSV written by Arrow straight to bytes (no intermediate str),
+    with values formatted as DataFrame.to_csv would (Arrow still quotes every
+    string field, which CSV readers parse identically). Frames Arrow cannot
+    convert (mixed-type object columns, duplicate column names) fall back to
+    pandas' CSV writer."""
+    try:
+        buf = io.BytesIO()
+        pacsv.write_csv(pa.Table.from_pandas(_pandas_csv_text(df), preserve_index=False), buf)
+        return buf.getvalue()
+    except (pa.ArrowException, ValueError):
+        return df.to_csv(index=False).encode("utf-8")
+
+
+@st.cache_data(show_spinner=False, max_entries=32, hash_funcs={pd.DataFrame: _df_hash})
+def _to_parquet_bytes(df: pd.DataFrame) -> Optional[bytes]:
+    """Parquet (zstd level 3): columnar and compressed, much smaller than CSV.
+    None when Arrow cannot convert the frame; the Parquet button is then hidden."""
+    try:
+        buf = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buf,
+                       compression="zstd", compression_level=3)
+        return buf.getvalue()
+    except (pa.ArrowException, ValueError):
+        return None
+
+
+DISPLAY_MAX_ROWS = 10_000
+
+
+def _slim_for_display(df: pd.DataFrame, max_rows: int = DISPLAY_MAX_ROWS) -> pd.DataFrame:
+    """Smaller frame for st.dataframe: first max_rows rows, all-NaN columns
+    dropped, integer columns downcast. Floats are left alone so shown values
+    match the downloads, which keep the full frame. Columns are handled by
+    position, since SQL results can repeat a column name."""
+    df = df.head(max_rows).copy()
+    if len(df):
+        df = df.dropna(axis=1, how="all")
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        if pd.api.types.is_integer_dtype(col):
+            df.isetitem(i, pd.to_numeric(col, downcast="integer"))
+    return df
+
+
 # --- Session state for last results ---
 # Keep prior results stable across Streamlit's re-runs (e.g., when clicking download).
 if "last_state" not in st.session_state:
@@ -51,7 +175,84 @@ if st.button("Run", type="primary"):
     else:
         with st.spinner("Thinking, generating SQL, validating, and visualizing…"):
             # The heavy lifting happens in backend workflow modules.
-            st.session_state.last_state = run_full(question, max_retries=max_retries)
+            result = _with_viz_outputs(_run_full_cached(question, int(max_retries)))
+            # Stringify the filter structures once here rather than on every rerun.
+            result["_filters_raw_str"] = str(result["filters_raw"])
+            result["_filters_matched_str"] = str(result["filters_matched"])
+            st.session_state.last_state = result
+
+# SQL display + download/copy widgets run as a fragment: interacting with them
+# reruns only this panel, and the copy-button iframe is not re-injected by
+# unrelated reruns of the rest of the page.
+@st.fragment
+def _sql_panel(sql_text: str) -> None:
+    st.subheader("Generated SQL")
+    st.code(sql_text, language="sql")
+    col_sql_1, col_sql_2 = st.columns(2)
+
+    with col_sql_1:
+        # One-click save of the produced SQL for offline use.
+        st.download_button(
+            "Download SQL",
+            data=sql_text.encode("utf-8"),
+            file_name="query.sql",
+            mime="text/sql",
+            use_container_width=True,
+            key="download_sql_btn",
+        )
+
+    with col_sql_2:
+        # Safe copy-to-clipboard using an injected, sandboxed script.
+        # JSON-encode the SQL to avoid breaking out of the string with quotes/newlines.
+        escaped_sql = _js_string(sql_text)
+        components.html(
+            f"""
+            <div style="display:flex;gap:8px;align-items:center;">
+              <button
+                id="copy-sql-btn"
+                style="width:100%;padding:0.5rem 0.75rem;border:1px solid #ddd;border-radius:6px;cursor:pointer;background:#f6f6f6;"
+              >Copy SQL</button>
+            </div>
+            <script>
+              const SQL = {escaped_sql};
+              const btn = document.getElementById('copy-sql-btn');
+              btn.addEventListener('click', async () => {{
+                try {{
+                  await navigator.clipboard.writeText(SQL);
+                  const old = btn.innerText;
+                  btn.innerText = 'Copied!';
+                  setTimeout(() => btn.innerText = old, 1200);
+                }} catch (err) {{
+                  console.error(err);
+                }}
+              }});
+            </script>
+            """,
+            height=80,
+        )
+
+# Result downloads also run as a fragment, so clicking them reruns only the
+# buttons and does not rebuild/resend the figure or table above them.
+@st.fragment
+def _downloads_panel(download_df: pd.DataFrame) -> None:
+    st.download_button(
+        "Download results (CSV)",
+        data=_to_csv_bytes(download_df),
+        file_name="results.csv",
+        mime="text/csv",
+        use_container_width=True,
+        key="download_results_btn",
+    )
+    parquet_bytes = _to_parquet_bytes(download_df)
+    if parquet_bytes is not None:
+        st.download_button(
+            "Download results (Parquet)",
+            data=parquet_bytes,
+            file_name="results.parquet",
+            mime="application/octet-stream",
+            use_container_width=True,
+            key="download_results_parquet_btn",
+        )
 
 # Always render from session (so reruns e.g., downloads don't clear the UI)
 state = st.session_state.last_state
@@ -63,60 +264,15 @@ else:
     c1, c2 = st.columns([0.45, 0.55])
 
     with c1:
-        st.subheader("Generated SQL")
-        st.code(state["sql"], language="sql")
-
-        sql_text = state.get("sql", "") or ""
-        col_sql_1, col_sql_2 = st.columns(2)
-
-        with col_sql_1:
-            # One-click save of the produced SQL for offline use.
-            st.download_button(
-                "Download SQL",
-                data=sql_text.encode("utf-8"),
-                file_name="query.sql",
-                mime="text/sql",
-                use_container_width=True,
-                key="download_sql_btn",
-            )
-
-        with col_sql_2:
-            # Safe copy-to-clipboard using an injected, sandboxed script.
-            # JSON-encode the SQL to avoid breaking out of the string with quotes/newlines.
-            escaped_sql = json.dumps(sql_text)
-            components.html(
-                f"""
-                <div style="display:flex;gap:8px;align-items:center;">
-                  <button
-                    id="copy-sql-btn"
-                    style="width:100%;padding:0.5rem 0.75rem;border:1px solid #ddd;border-radius:6px;cursor:pointer;background:#f6f6f6;"
-                  >Copy SQL</button>
-                </div>
-                <script>
-                  const SQL = {escaped_sql};
-                  const btn = document.getElementById('copy-sql-btn');
-                  btn.addEventListener('click', async () => {{
-                    try {{
-                      await navigator.clipboard.writeText(SQL);
-                      const old = btn.innerText;
-                      btn.innerText = 'Copied!';
-                      setTimeout(() => btn.innerText = old, 1200);
-                    }} catch (err) {{
-                      console.error(err);
-                    }}
-                  }});
-                </script>
-                """,
-                height=80,
-            )
+        _sql_panel(state.get("sql", "") or "")
 
         # Helpful debug/tracing info for power users and QA.
         st.caption("Selected columns (from agents)")
         st.write(state["columns_selected"])
 
         st.caption("Filters (raw → matched)")
-        st.code(str(state["filters_raw"]))
-        st.code(str(state["filters_matched"]))
+        st.code(state["_filters_raw_str"])
+        st.code(state["_filters_matched_str"])
 
         st.subheader("BI Expert Recommendation")
         st.write(state["visualization_request"])
@@ -143,13 +299,15 @@ else:
         if fig is not None:
             st.plotly_chart(fig, use_container_width=True)
         elif isinstance(df_viz, pd.DataFrame):
-            st.dataframe(df_viz, use_container_width=True)
+            st.dataframe(_slim_for_display(df_viz), use_container_width=True)
+            if len(df_viz) > DISPLAY_MAX_ROWS:
+                st.caption(f"Showing the first {DISPLAY_MAX_ROWS:,} of {len(df_viz):,} rows; downloads include all rows.")
         elif text_v:
             st.markdown(text_v)
         else:
             st.info("No figure/table/text produced by the visualization code.")
 
-        # Provide a CSV download: prefer the viz table (if produced), else raw SQL df.
+        # Provide CSV/Parquet downloads: prefer the viz table (if produced), else raw SQL df.
         download_df = None
         if isinstance(df_viz, pd.DataFrame) and not df_viz.empty:
             download_df = df_viz
@@ -157,12 +315,4 @@ else:
             download_df = state["df"]
 
         if download_df is not None:
-            csv_bytes = download_df.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                "Download results (CSV)",
-                data=csv_bytes,
-                file_name="results.csv",
-                mime="text/csv",
-                use_container_width=True,
-                key="download_results_btn",
-            )
+            _downloads_panel(download_df)
@@ -0,0 +1,28 @@
+"""Tests for utils.first_sql_statement (early stop on streamed SQL replies)."""
+from utils import first_sql_statement
+
+
+def test_stops_at_first_top_level_semicolon():
+    assert first_sql_statement("SELECT 1; SELECT 2;") == "SELECT 1;"
+    assert first_sql_statement("SELECT ';' AS s FROM t") is None
+    assert first_sql_statement("SELECT (1;") is None
+
+
+def test_semicolons_in_comments_are_skipped():
+    assert first_sql_statement("-- note; here\nSELECT 1;") == "-- note; here\nSELECT 1;"
+    assert first_sql_statement("# a;b\nSELECT 1;").endswith("SELECT 1;")
+    assert first_sql_statement("SELECT /* x; y */ 1;") == "SELECT /* x; y */ 1;"
+    assert first_sql_statement("SELECT 1 /* unfinished;") is None
+    assert first_sql_statement("SELECT 1 -- still streaming;") is None
+
+
+def test_fenced_reply():
+    assert first_sql_statement("```sql\nSELECT `a;b` FROM t;\n```") == "SELECT `a;b` FROM t;"
+    assert first_sql_statement("```sql\nSELECT 1\n```") == "SELECT 1"
+    assert first_sql_statement("```sq") is None
+
+
+def test_backslash_escaped_quotes():
+    assert first_sql_statement("SELECT 'it\\'s;' FROM t;") == "SELECT 'it\\'s;' FROM t;"
+    assert first_sql_statement("SELECT 'a\\\\'; SELECT 2;") == "SELECT 'a\\\\';"
+    assert first_sql_statement("SELECT 'it\\'s;") is None
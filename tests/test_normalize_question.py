@@ -0,0 +1,26 @@
+"""Regression tests for utils.normalize_question (whole-question cache key)."""
+from utils import normalize_question
+
+
+def test_comparison_operators_are_kept():
+    gt = normalize_question("How many sellers have > 100 orders?")
+    lt = normalize_question("How many sellers have < 100 orders?")
+    assert gt != lt
+    assert normalize_question("price >= 5") != normalize_question("price <= 5")
+
+
+def test_numbers_keep_internal_separators():
+    assert normalize_question("orders above 1.5") != normalize_question("orders above 1 5")
+    assert "2017-01-01" in normalize_question("orders on 2017-01-01?")
+
+
+def test_trivial_differences_share_a_key():
+    assert normalize_question("Which payment type is most used?") == normalize_question(
+        "which  payment type is most used"
+    )
+    assert normalize_question("price>100!") == normalize_question("Price > 100")
+
+
+def test_signs_and_leading_points_are_kept():
+    assert normalize_question("balance < -5") != normalize_question("balance < 5")
+    assert normalize_question("score above .5") != normalize_question("score above 5")
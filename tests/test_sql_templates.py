@@ -0,0 +1,22 @@
+"""Tests for sql_templates.match_template (LIMIT handling of top-N questions)."""
+from sql_templates import match_template
+
+
+def test_singular_question_limits_to_one():
+    _, sql, _ = match_template("Which seller received the most orders?")
+    assert sql.endswith("LIMIT 1;")
+
+
+def test_top_n_uses_the_given_number():
+    _, sql, _ = match_template("Top 5 sellers with the most orders")
+    assert sql.endswith("LIMIT 5;")
+
+
+def test_plural_without_number_and_top_zero_fall_through():
+    assert match_template("Which sellers have the most orders?") is None
+    assert match_template("Top 0 sellers with the most orders") is None
+
+
+def test_review_average_counts_each_order_once_per_category():
+    _, sql, _ = match_template("Average review score by category")
+    assert "SELECT DISTINCT order_reviews.order_id" in sql
@@ -8,46 +8,109 @@ Small utilities for:
 
 Important:
 - Functions here are side-effect free except fuzzy matchers, which read the DB.
+  Their per-column choice indexes are cached (st.cache_resource under
+  Streamlit, lru_cache otherwise).
 """
 
 from __future__ import annotations
 import ast
-import json
 import re
-from typing import List
+import sys
+from functools import lru_cache
+from typing import List, Optional
 
-import pandas as pd
+import orjson
 from sqlalchemy import text
 
-from config import get_engine
+from config import get_engine, DISTINCT_VALUES_TTL, DISTINCT_VALUES_MAX_ENTRIES, DISTINCT_VALUES_LIMIT
+
+# Optional fast fuzzy matching (cdist results are numpy arrays)
+try:
+    import numpy as np
+    from rapidfuzz import process as _rf_process, fuzz as _rf_fuzz
+    _HAVE_RAPIDFUZZ = True
+except ImportError:
+    _HAVE_RAPIDFUZZ = False
 
 # -------------- Parsing helpers --------------
+def to_json(obj) -> str:
+    """Canonical JSON text (orjson, sorted keys) for prompt payloads and cache keys."""
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS).decode()
+
+NESTED_LIST_RE = re.compile(r"\[\s*\[.*?\]\s*(,\s*\[.*?\]\s*)*\]", re.DOTALL)
+_FENCE_RE = re.compile(r"^```[A-Za-z]*\s*|\s*```$")
+
+def strip_code_fences(s: str) -> str:
+    """Remove a leading ```<lang> and trailing ``` fence, if present."""
+    return _FENCE_RE.sub("", s).strip()
+
+_QUOTE_SWAP = str.maketrans("'", '"')
+
+def _extract_bracket_fallback(s: str) -> list:
+    """First top-level [ [ ... ], ... ] block in s, parsed; [] if none."""
+    if "[" not in s:
+        return []
+    m = NESTED_LIST_RE.search(s)
+    if m:
+        try:
+            obj = ast.literal_eval(m.group(0))
+            return obj if isinstance(obj, list) else []
+        except Exception:
+            return []
+    return []
+
 def parse_nested_list(text_in: str) -> list:
-    """Parse model output into a Python list; tries JSON, then literal_eval, then bracket extraction."""
+    """Parse model output into a Python list; strips code fences, then tries
+    JSON, then JSON with single quotes swapped for double, then literal_eval,
+    then bracket extraction. Text that does not start with '[' goes straight
+    to bracket extraction."""
     if not text_in:
         return []
-    s = str(text_in).strip()
-    # Try JSON
+    s = strip_code_fences(str(text_in).strip())
+    if not s:
+        return []
+    if s[0] != "[":
+        return _extract_bracket_fallback(s)
+    # Try JSON (orjson is a C parser; much cheaper than literal_eval)
     try:
-        obj = json.loads(s)
+        obj = orjson.loads(s)
         return obj if isinstance(obj, list) else []
     except Exception:
         pass
-    # Try Python literal
+    # Python-style single-quoted list: one translate pass, then the C parser
+    # again. Skipped with double quotes or backslashes present, where swapping
+    # could change the content.
+    if "'" in s and '"' not in s and "\\" not in s:
+        try:
+            obj = orjson.loads(s.translate(_QUOTE_SWAP))
+            return obj if isinstance(obj, list) else []
+        except Exception:
+            pass
+    # Last resort: Python literal (True/None/tuples, mixed quoting)
     try:
         obj = ast.literal_eval(s)
         return obj if isinstance(obj, list) else []
     except Exception:
         pass
     # Fallback: first top-level [ [ ... ], ... ] pattern
-    m = re.search(r"\[\s*\[.*?\]\s*(,\s*\[.*?\]\s*)*\]", s, re.DOTALL)
-    if m:
-        try:
-            obj = ast.literal_eval(m.group(0))
-            return obj if isinstance(obj, list) else []
-        except Exception:
-            return []
-    return []
+    return _extract_bracket_fallback(s)
+
+_WS_RE = re.compile(r"\s+")
+
+def normalize_text(s: str) -> str:
+    """Lowercase and collapse whitespace; used for cache keys, not prompts."""
+    return _WS_RE.sub(" ", str(s).strip().lower())
+
+# Punctuation that does not change a question's meaning. Comparison/percent
+# signs, separators inside numbers (1.5, 2017-01-01, 1,000) and a sign or
+# leading point before a digit (-5, .5) are kept.
+_PUNCT_RE = re.compile(r"(?![.-]\d)(?!(?<=\d)[,:/](?=\d))(?!!=)[^\w\s<>=%$]")
+_CMP_RE = re.compile(r"!=|[<>=]+")
+
+def normalize_question(s: str) -> str:
+    """normalize_text minus meaning-free punctuation; key for whole-question caches."""
+    s = _PUNCT_RE.sub(" ", str(s))
+    return normalize_text(_CMP_RE.sub(lambda m: f" {m.group(0)} ", s))
 
 def normalize_subquestions(entries: list) -> List[List[str]]:
     """Ensure each entry is exactly [subquestion, table]."""
@@ -60,6 +123,9 @@ def normalize_subquestions(entries: list) -> List[List[str]]:
                 norm.append([subq, table])
     return norm
 
+_FENCED_SQL_RE = re.compile(r"```(?:\s*sql)?\s*(.*?)```", re.I | re.S)
+_SELECT_RE = re.compile(r"(?is)\bselect\b.*")
+
 def extract_sql(text_in: str) -> str:
     """
     Extract SQL from a ```sql ...``` fenced block, else from first SELECT onward, else raw stripped.
@@ -68,16 +134,72 @@ def extract_sql(text_in: str) -> str:
         return ""
     s = str(text_in)
     # Prefer fenced ```sql ... ```
-    m = re.search(r"```(?:\s*sql)?\s*(.*?)```", s, flags=re.I | re.S)
+    m = _FENCED_SQL_RE.search(s)
     if m:
         return m.group(1).strip()
     # Else from first SELECT
-    m = re.search(r"(?is)\bselect\b.*", s)
+    m = _SELECT_RE.search(s)
     if m:
         return m.group(0).strip()
     return s.strip()
 
+def _closing_quote(s: str, start: int) -> int:
+    """Index of the quote closing the one at s[start], or -1; a backslash escapes the next char."""
+    q = s[start]
+    i = start + 1
+    while i < len(s):
+        if s[i] == "\\" and q != "`":
+            i += 2
+        elif s[i] == q:
+            return i
+        else:
+            i += 1
+    return -1
+
+def first_sql_statement(text_in: str) -> Optional[str]:
+    """First complete statement of a streamed SQL reply (fences, quotes, comments skipped), else None."""
+    s = text_in.lstrip()
+    fenced = s.startswith("`")
+    if fenced:
+        nl = s.find("\n")
+        if nl < 0:
+            return None  # opening ```sql line still streaming
+        s = s[nl + 1:]
+    depth = 0
+    i = 0
+    while i < len(s):
+        ch = s[i]
+        if fenced and s.startswith("```", i):
+            return s[:i].strip() or None
+        if ch in ("'", '"', "`"):
+            end = _closing_quote(s, i)
+        elif ch == "#" or s.startswith("--", i):
+            end = s.find("\n", i)
+        elif s.startswith("/*", i):
+            end = s.find("*/", i + 2)
+            end = end + 1 if end >= 0 else -1
+        else:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            elif ch == ";" and depth <= 0:
+                return s[: i + 1].strip()
+            i += 1
+            continue
+        if end < 0:
+            return None  # quote/comment not closed yet
+        i = end + 1
+    return None
+
 # -------------- Code block extraction --------------
+_FENCED_ANY_RE = re.compile(r"```(.*?)```", re.DOTALL)
+
+@lru_cache(maxsize=16)
+def _code_block_re(language: str) -> re.Pattern:
+    """```<language> ... ``` pattern, compiled once per language."""
+    return re.compile(rf"```(?:\s*{re.escape(language)})\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
 def extract_code_block(content: str, language: str) -> str:
     """
     Extract code from a fenced block: ```<language> ... ```
@@ -87,37 +209,90 @@ def extract_code_block(content: str, language: str) -> str:
         return ""
     s = str(content)
     # ```language ... ```
-    pattern_lang = rf"```(?:\s*{re.escape(language)})\s*(.*?)```"
-    m = re.search(pattern_lang, s, re.DOTALL | re.IGNORECASE)
+    m = _code_block_re(language).search(s)
     if m:
         return m.group(1).strip()
     # First fenced block
-    m = re.search(r"```(.*?)```", s, re.DOTALL)
+    m = _FENCED_ANY_RE.search(s)
     if m:
         return m.group(1).strip()
     return s.replace("```", "").strip()
 
 # -------------- Fuzzy filter matcher --------------
-_engine = get_engine()
+def _under_streamlit() -> bool:
+    """True inside a running Streamlit app. Only checks an already-imported
+    streamlit, so CLI/worker imports of this module stay cheap."""
+    st = sys.modules.get("streamlit")
+    return st is not None and st.runtime.exists()
 
-def _get_values(table_name: str, column_name: str):
-    q = text(f"SELECT DISTINCT {column_name} AS v FROM {table_name}")
-    df = pd.read_sql(q, con=_engine)
-    return df["v"].dropna().astype(str).tolist()
+def _cached_engine():
+    return get_engine()
 
-def _best_fuzzy_match(input_value: str, choices):
-    #  replacement for rapidfuzz token_set_ratio using simple heuristic if RF not installed
-    try:
-        from rapidfuzz import process, fuzz
-        match, score, _ = process.extractOne(input_value, choices, scorer=fuzz.token_set_ratio)
-        return match, score
-    except Exception:
-        # Very light fallback: exact or casefold match, else return original
-        s = str(input_value).casefold()
-        for c in choices:
-            if s == str(c).casefold():
-                return c, 100
-        return input_value, 0
+def _normalize_value(v: str) -> str:
+    return v.casefold().strip()
+
+def _get_values(table_name: str, column_name: str) -> List[str]:
+    """Distinct non-NULL values of a column, as strings.
+
+    Names come from model output, so they are quoted as identifiers (a
+    "table.column" form keeps only the column), and at most
+    DISTINCT_VALUES_LIMIT values are fetched."""
+    engine = _cached_engine()
+    quote = engine.dialect.identifier_preparer.quote_identifier
+    column = quote(column_name.rsplit(".", 1)[-1])
+    q = text(f"SELECT DISTINCT {column} AS v FROM {quote(table_name)} LIMIT :lim")
+    # Plain cursor fetch: one column needs no DataFrame construction.
+    with engine.connect() as conn:
+        rows = conn.execute(q, {"lim": DISTINCT_VALUES_LIMIT}).scalars().all()
+    return [str(v) for v in rows if v is not None]
+
+def _choices_index(table_name: str, column_name: str) -> tuple[List[str], List[str]]:
+    """(original distinct values, casefolded/stripped values), index-aligned.
+    Normalized once per column so matching never re-normalizes the choices."""
+    originals = _get_values(table_name, column_name)
+    return originals, [_normalize_value(v) for v in originals]
+
+# Under Streamlit the engine and the per-column choice indexes are shared
+# resources: one copy across sessions and reruns, refreshed after
+# DISTINCT_VALUES_TTL and returned without the copy st.cache_data makes on
+# every hit (indexes are read-only). Elsewhere an in-process LRU (no expiry)
+# keeps one DB round-trip per (table, column).
+if _under_streamlit():
+    import streamlit as st
+    _cached_engine = st.cache_resource(show_spinner=False)(_cached_engine)
+    _choices_index = st.cache_resource(
+        ttl=DISTINCT_VALUES_TTL, max_entries=DISTINCT_VALUES_MAX_ENTRIES, show_spinner=False
+    )(_choices_index)
+else:
+    _choices_index = lru_cache(maxsize=DISTINCT_VALUES_MAX_ENTRIES)(_choices_index)
+
+def _best_fuzzy_match(input_value: str, values: tuple[List[str], List[str]]):
+    """Best original value for input_value, scored with fuzz.ratio on the
+    normalized strings (categorical values are short, so token-set scoring
+    buys little); returns (match, score)."""
+    originals, normalized = values
+    query = _normalize_value(str(input_value))
+    if _HAVE_RAPIDFUZZ:
+        _, score, idx = _rf_process.extractOne(query, normalized, scorer=_rf_fuzz.ratio)
+        return originals[idx], score
+    # Very light fallback: exact casefold match, else return original
+    for c, n in zip(originals, normalized):
+        if query == n:
+            return c, 100
+    return input_value, 0
+
+def _best_fuzzy_matches_batch(queries: List[str], values: tuple[List[str], List[str]]) -> List[tuple]:
+    """_best_fuzzy_match for several queries against the same values: one
+    rapidfuzz cdist call scores the whole queries x choices matrix (threaded),
+    then the best choice per row is taken. Falls back to per-query matching."""
+    if len(queries) == 1 or not _HAVE_RAPIDFUZZ:
+        return [_best_fuzzy_match(q, values) for q in queries]
+    originals, normalized = values
+    scores = _rf_process.cdist(
+        [_normalize_value(str(q)) for q in queries], normalized, scorer=_rf_fuzz.ratio, workers=-1
+    )
+    best = np.argmax(scores, axis=1)
+    return [(originals[j], float(scores[i, j])) for i, j in enumerate(best)]
 
 def _flatten_filters_structure(filters):
     """
@@ -134,11 +309,30 @@ def _flatten_filters_structure(filters):
         and len(filters) == 2
         and isinstance(filters[1], list)
         and filters[1]
-        and all(isinstance(x, list) for x in filters[1])
+        # Invariant: the model emits either all-nested or all-flat rows, so
+        # the first element's type decides for the whole list.
+        and isinstance(filters[1][0], list)
     ):
         return ["yes", *filters[1]]
     return filters
 
+# Predicates with letters and no range/date operators are treated as
+# categorical equality and fuzzy-matched. One pattern classifies both: "op" is
+# tried first at each position so letters of e.g. "before" are not taken as
+# plain alpha.
+_CLASSIFY_RE = re.compile(
+    r"(?P<op>\bbetween\b|<=|>=|<|>|before|after|\d{4}-\d{2}-\d{2})|(?P<alpha>[A-Za-z])", re.I
+)
+
+def _is_categorical(predicate: str) -> bool:
+    """True for textual equality-like predicates (letters, no operators)."""
+    has_alpha = False
+    for m in _CLASSIFY_RE.finditer(predicate):
+        if m.lastgroup == "op":
+            return False
+        has_alpha = True
+    return has_alpha
+
 def fuzzy_match_filters(filters):
     """
     For categorical equality-like predicates (no operators), fuzzy-match the value
@@ -149,22 +343,31 @@ def fuzzy_match_filters(filters):
       ["yes", [ ["table","column","predicate"], ... ]]
     Output (same shape, normalized to flat):
       ["yes", ["table","column","matched_value"], ...]
+
+    Distinct values are fetched once per (table, column), however many
+    predicates target it.
     """
     if not isinstance(filters, list) or not filters or filters[0] == "no":
         return filters
     filters = _flatten_filters_structure(filters)
-    out = ["yes"]
-    for t in filters[1:]:
+    # Pre-sized; malformed entries stay None and are dropped at the end.
+    out: list = ["yes"] + [None] * (len(filters) - 1)
+    # (table, column) -> indices into out of textual equality-like predicates
+    needs: dict[tuple[str, str], list[int]] = {}
+    for i, t in enumerate(filters[1:], start=1):
         if not isinstance(t, list) or len(t) < 3:
             continue
         table, column, predicate = t[0], t[1], str(t[2]).strip()
-        # textual equality-like predicate (no ranges/dates/operators)
-        if re.search(r"[A-Za-z]", predicate) and not re.search(
-            r"\bbetween\b|<=|>=|<|>|before|after|\d{4}-\d{2}-\d{2}", predicate, re.I
-        ):
-            choices = _get_values(table, column)
-            best, _ = _best_fuzzy_match(predicate, choices) if choices else (predicate, 0)
-            out.append([table, column, best])
-        else:
-            out.append([table, column, predicate])
+        if _is_categorical(predicate):
+            needs.setdefault((table, column), []).append(i)
+        out[i] = [table, column, predicate]
+    for (table, column), idxs in needs.items():
+        values = _choices_index(table, column)
+        if not values[0]:
+            continue
+        matches = _best_fuzzy_matches_batch([out[i][2] for i in idxs], values)
+        for i, (best, _) in zip(idxs, matches):
+            out[i][2] = best
+    if None in out:
+        out = [x for x in out if x is not None]
     return out